@@ -1,25 +1,88 @@
+import hashlib
 import json
+import math
+import os
+import re
+import tempfile
+from importlib import resources
 from pathlib import Path
 from typing import Any, List, Optional
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ReadTimeout, ConnectionError, RequestException
 
-from config.llm_config import LLMConfig
+from config.llm_config import get_config
 
 from langchain_core.outputs import Generation, LLMResult
-from langchain_core.prompts import PromptTemplate
-from langchain_classic.chains.llm import LLMChain
 from langchain_core.language_models.llms import BaseLLM
 
+# Shared keep-alive session so repeated Ollama calls reuse pooled connections
+# instead of paying a fresh TCP handshake per request.
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=0)
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.headers.update({"Connection": "keep-alive"})
+
+OLLAMA_GENERATE_URL = f"{get_config().ollama_base_url}/api/generate"
+
+# Matches only brace characters, so balanced-object extraction steps from
+# brace to brace instead of visiting every character of the model output.
+_BRACE_RE = re.compile(r"[{}]")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+# Transcripts longer than this are split and generated as concurrent chunks.
+MAX_CHUNK_CHARS = 4000
+MAX_CONCURRENT_CHUNKS = 8
+
+def _generate_concurrently(llm: BaseLLM, prompts: List[str]) -> LLMResult:
+    """Run llm._call over prompts on a thread pool, preserving prompt order."""
+    workers = min(len(prompts), llm.max_concurrency)
+    if workers <= 1:
+        texts = [llm._call(p) for p in prompts]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            texts = list(executor.map(llm._call, prompts))
+    return LLMResult(generations=[[Generation(text=t)] for t in texts])
+
+def _post_with_retry(session: requests.Session, url: str, payload: dict, timeout: float, max_retries: int) -> requests.Response:
+    """POST a streaming request, retrying read timeouts and 5xx responses.
+
+    Backoff starts at 100ms and is capped at 2s: a timed-out Ollama server is
+    usually warm and just slow, so long sleeps only add idle wall-clock.
+    """
+    attempt = 0
+    while True:
+        try:
+            response = session.post(url, json=payload, stream=True, timeout=timeout)
+            if response.status_code < 500 or attempt + 1 >= max_retries:
+                response.raise_for_status()
+                return response
+            response.close()
+        except ReadTimeout:
+            if attempt + 1 >= max_retries:
+                raise RuntimeError(f"Read timed out while contacting Ollama at {url}. Increase OLLAMA_TIMEOUT or check the Ollama server.") from None
+        except ConnectionError:
+            raise RuntimeError(f"Connection error when contacting Ollama at {url}. Is the server running and reachable?") from None
+        except RequestException as e:
+            raise RuntimeError(f"Error contacting Ollama: {e}") from e
+        time.sleep(min(0.1 * (2 ** attempt), 2.0))
+        attempt += 1
+
 class OllamaLLM(BaseLLM):
+    max_concurrency: int = 8
+
     @property
     def lc_type(self) -> str:
         return "ollama"
 
     def _call(self, prompt: str, stop=None) -> str:
-        llm_config = LLMConfig()
-        url = f"{llm_config.ollama_base_url}/api/generate"
+        llm_config = get_config()
+        url = OLLAMA_GENERATE_URL
 
         payload = {
             "model": llm_config.ollama_model,
@@ -28,32 +91,20 @@ class OllamaLLM(BaseLLM):
         }
 
         max_retries = max(1, llm_config.ollama_max_retries)
-        timeout = llm_config.ollama_timeout
-        attempt = 0
-        while True:
-            try:
-                response = requests.post(url, json=payload, stream=True, timeout=timeout)
-                response.raise_for_status()
-                break
-            except ReadTimeout:
-                attempt += 1
-                if attempt >= max_retries:
-                    raise RuntimeError(f"Read timed out while contacting Ollama at {url}. Increase OLLAMA_TIMEOUT or check the Ollama server.") from None
-                time.sleep(2 ** attempt)
-            except ConnectionError:
-                raise RuntimeError(f"Connection error when contacting Ollama at {url}. Is the server running and reachable at {llm_config.ollama_base_url}?") from None
-            except RequestException as e:
-                raise RuntimeError(f"Error contacting Ollama: {e}") from e
+        response = _post_with_retry(_SESSION, url, payload, llm_config.ollama_timeout, max_retries)
 
+        # Parse the NDJSON stream as raw bytes; orjson decodes UTF-8 itself, so
+        # there is no need for requests to decode every chunk first.
         output = []
+        append = output.append
         try:
-            for line in response.iter_lines(decode_unicode=True):
+            for line in response.iter_lines(decode_unicode=False):
                 if not line:
                     continue
                 try:
-                    obj = json.loads(line)
-                    if "response" in obj:
-                        output.append(obj["response"])
+                    obj = orjson.loads(line)
+                    if isinstance(chunk := obj.get("response"), str):
+                        append(chunk)
                     if obj.get("done"):
                         break
                 except Exception:
@@ -72,28 +123,35 @@ class OllamaLLM(BaseLLM):
         return {}
 
     def _generate(self, prompts, **kwargs):
-        return LLMResult(
-            generations=[[Generation(text=self._call(p))] for p in prompts]
-        )
+        return _generate_concurrently(self, prompts)
+
+@lru_cache(maxsize=1)
+def _openai_client():
+    """Build the OpenAI client once; its httpx pool keeps connections alive."""
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    )
+    return OpenAI(api_key=get_config().api_key, http_client=http_client)
 
 class APIBasedLLM(BaseLLM):
+    max_concurrency: int = 8
+
     @property
     def lc_type(self) -> str:
         return "api"
 
     def _call(self, prompt: str, stop=None) -> str:
-        import openai
-
-        llm_config = LLMConfig()
-        openai.api_key = llm_config.api_key
-
-        response = openai.ChatCompletion.create(
+        response = _openai_client().chat.completions.create(
             model="gpt-4",
             messages=[{"role": "user", "content": prompt}],
             max_tokens=500
         )
 
-        return response.choices[0].message["content"]
+        return response.choices[0].message.content
 
     @property
     def _llm_type(self) -> str:
@@ -104,86 +162,274 @@ class APIBasedLLM(BaseLLM):
         return {}
 
     def _generate(self, prompts, **kwargs):
-        return LLMResult(
-            generations=[[Generation(text=self._call(p))] for p in prompts]
-        )
+        return _generate_concurrently(self, prompts)
+
+_ELEMENT_KEYS = ("type", "content", "position", "color", "animation", "scale")
+
+
+def _is_valid_scene(scene: Any) -> bool:
+    """Cheap check that a scene already has the shape _normalize_storyboard produces."""
+    if not isinstance(scene, dict):
+        return False
+    scene_id = scene.get("scene_id")
+    duration = scene.get("duration")
+    if not isinstance(scene_id, int) or isinstance(scene_id, bool):
+        return False
+    if not isinstance(duration, (int, float)) or isinstance(duration, bool):
+        return False
+    if not isinstance(scene.get("narration"), str) or not isinstance(scene.get("animation_type"), str):
+        return False
+    elements = scene.get("elements")
+    if not isinstance(elements, list):
+        return False
+    return all(isinstance(e, dict) and all(k in e for k in _ELEMENT_KEYS) for e in elements)
+
+def _normalize_storyboard(sb: dict) -> dict:
+    """Coerce a parsed storyboard into the minimal schema the renderer expects."""
+    if not isinstance(sb, dict):
+        return sb
+    if "title" not in sb:
+        sb["title"] = "Generated Storyboard"
+    if "scenes" not in sb or not isinstance(sb["scenes"], list):
+        sb["scenes"] = []
+
+    # Schema-compliant model output needs no rebuilding
+    if all(_is_valid_scene(s) for s in sb["scenes"]):
+        return sb
+
+    normalized = []
+    for idx, s in enumerate(sb["scenes"], start=1):
+        if not isinstance(s, dict):
+            s = {"narration": str(s)}
+        # Explicit None checks so a legitimate scene_id of 0 is kept
+        scene_id = s.get("scene_id")
+        if scene_id is None:
+            scene_id = s.get("id")
+        if scene_id is None:
+            scene_id = idx
+        duration = s.get("duration", 5)
+        narration = s.get("narration") or s.get("description") or s.get("text") or ""
+        animation_type = s.get("animation_type") or s.get("type") or "text"
+
+        elements = s.get("elements") or s.get("actions") or []
+        normalized_elements = []
+        append = normalized_elements.append
+        for e in elements:
+            if isinstance(e, str):
+                append({
+                    "type": "text",
+                    "content": e,
+                    "position": [0, 0],
+                    "color": "WHITE",
+                    "animation": "FadeIn",
+                    "scale": 1.0
+                })
+            elif isinstance(e, dict):
+                get = e.get
+                append({
+                    "type": get("type", "text"),
+                    "content": get("content", ""),
+                    "position": get("position", [0, 0]),
+                    "color": get("color", "WHITE"),
+                    "animation": get("animation", "FadeIn"),
+                    "scale": get("scale", 1.0)
+                })
 
-PROMPT_FILE = Path(__file__).parent.parent / "prompts" / "storyboard_prompt.txt"
-with open(PROMPT_FILE, "r", encoding="utf-8") as f:
-    STORYBOARD_PROMPT = f.read()
+        normalized.append({
+            "scene_id": int(scene_id),
+            "duration": duration,
+            "narration": narration,
+            "animation_type": animation_type,
+            "elements": normalized_elements
+        })
+
+    sb["scenes"] = normalized
+    return sb
+
+def _split_transcript(transcript: str, max_chars: int = 4000) -> List[str]:
+    """Split a transcript into chunks of at most max_chars on paragraph boundaries.
+
+    Paragraphs are packed greedily; a single paragraph longer than max_chars
+    is cut at the last space before the limit.
+    """
+    pieces = []
+    for para in _PARAGRAPH_RE.split(transcript):
+        para = para.strip()
+        while len(para) > max_chars:
+            cut = para.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append(para[:cut])
+            para = para[cut:].lstrip()
+        if para:
+            pieces.append(para)
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 2 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _merge_storyboards(parts: List[Any]) -> dict:
+    """Concatenate chunk storyboards into one, renumbering scene ids from 1."""
+    merged = {"title": "Generated Storyboard", "scenes": []}
+    for idx, part in enumerate(p for p in parts if isinstance(p, dict)):
+        if idx == 0:
+            merged["title"] = part.get("title", merged["title"])
+            if "description" in part:
+                merged["description"] = part["description"]
+        merged["scenes"].extend(part.get("scenes", []))
+    for scene_id, scene in enumerate(merged["scenes"], start=1):
+        scene["scene_id"] = scene_id
+    return merged
+
+# Loaded through importlib.resources from the `prompts` package; it is a
+# regular package (not a namespace one) so no other `prompts` on sys.path
+# can shadow it.
+PROMPT_FILE = resources.files("prompts") / "storyboard_prompt.txt"
+STORYBOARD_PROMPT = PROMPT_FILE.read_text(encoding="utf-8")
+
+# Generated storyboards are cached per (prompt, model, transcript) so
+# re-running the pipeline on an unchanged transcript skips the LLM call.
+CACHE_DIR = Path(".cache")
+_PROMPT_HASH = hashlib.blake2b(STORYBOARD_PROMPT.encode("utf-8"), digest_size=16)
+
+
+
+def _loads_json(text: str) -> Any:
+    """Parse with orjson, falling back to the more lenient stdlib parser.
+
+    The stdlib accepts NaN/Infinity and lone surrogate escapes that orjson
+    rejects; both raise json.JSONDecodeError on failure.
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
+
+def _has_non_finite(obj: Any) -> bool:
+    """Return True if obj holds a NaN or infinite float anywhere inside it."""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(map(_has_non_finite, obj.values()))
+    if isinstance(obj, (list, tuple)):
+        return any(map(_has_non_finite, obj))
+    return False
+
+def _dumps_json(obj: Any, indent: bool = False) -> bytes:
+    """Serialize with orjson, falling back to the stdlib for what it mishandles.
+
+    Values parsed by the stdlib fallback cannot all be encoded by orjson:
+    lone surrogates make it raise, and NaN/Infinity are silently written as
+    null. json.dumps escapes the former as ASCII and keeps the latter.
+    """
+    try:
+        data = orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    except orjson.JSONEncodeError:
+        data = None
+    # A non-finite float can only have become a null, so skip the walk otherwise
+    if data is None or (b"null" in data and _has_non_finite(obj)):
+        return json.dumps(obj, indent=2 if indent else None).encode("ascii")
+    return data
+
+def _read_cached_storyboard(cache_path: Path) -> Optional[dict]:
+    """Return a cached storyboard, treating a missing or unreadable entry as a miss."""
+    try:
+        # Through _loads_json, so entries written by the stdlib fallback of
+        # _dumps_json (e.g. escaped lone surrogates) read back as hits
+        cached = _loads_json(cache_path.read_bytes())
+    except (OSError, ValueError):
+        return None
+    return cached if isinstance(cached, dict) else None
+
+def _write_cached_storyboard(cache_path: Path, storyboard: dict):
+    """Atomically write a cache entry so an interrupted run never leaves a truncated file.
+
+    The cache is an optimization only: if it cannot be written (read-only
+    checkout, `.cache` existing as a file, ...) the run carries on without it.
+    """
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        try:
+            f = os.fdopen(fd, "wb")
+        except BaseException:
+            os.close(fd)
+            raise
+        with f:
+            f.write(_dumps_json(storyboard))
+        os.replace(tmp_path, cache_path)
+    except BaseException as e:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        if not isinstance(e, OSError):
+            raise
 
 
 class StoryboardAgent:
     def __init__(self):
-        self.llm_config = LLMConfig()
+        self.llm_config = get_config()
+
+    def _cache_path(self, transcript: str) -> Path:
+        model = self.llm_config.api_provider if self.llm_config.use_api else self.llm_config.ollama_model
+        key = _PROMPT_HASH.copy()
+        key.update(b"\0" + model.encode("utf-8") + b"\0")
+        key.update(transcript.encode("utf-8"))
+        return CACHE_DIR / f"storyboard_{key.hexdigest()}.json"
+
+    def generate_storyboard(self, transcript: str, use_cache: bool = True) -> dict:
+        if len(transcript) > MAX_CHUNK_CHARS:
+            chunks = _split_transcript(transcript, MAX_CHUNK_CHARS)
+            if len(chunks) > 1:
+                return self._generate_chunked(chunks, use_cache)
+
+        cache_path = self._cache_path(transcript)
+        if use_cache:
+            cached = _read_cached_storyboard(cache_path)
+            if cached is not None:
+                return cached
 
-    def generate_storyboard(self, transcript: str) -> dict:
         llm = APIBasedLLM() if self.llm_config.use_api else OllamaLLM()
 
-        safe_prompt = STORYBOARD_PROMPT.replace("{", "{{").replace("}", "}}")
-        prompt = PromptTemplate(
-            template=safe_prompt + "\n\nTranscript:\n{transcript}",
-            input_variables=["transcript"]
-        )
-
-        chain = prompt | llm
-        raw_result = chain.invoke({"transcript": transcript})
-
-        # Extract text from various llm return types
-        result_text = None
-        if isinstance(raw_result, str):
-            result_text = raw_result
-        elif isinstance(raw_result, dict):
-            for key in ("text", "content", "response", "output", "result"):
-                if key in raw_result and isinstance(raw_result[key], str):
-                    result_text = raw_result[key]
-                    break
-            if not result_text and "generations" in raw_result:
-                try:
-                    result_text = raw_result["generations"][0][0]["text"]
-                except Exception:
-                    pass
-        else:
-            # Try attribute access for common LLM return objects
-            if hasattr(raw_result, "generations"):
-                try:
-                    gens = raw_result.generations
-                    if isinstance(gens, list) and gens and isinstance(gens[0], list):
-                        result_text = gens[0][0].text
-                except Exception:
-                    pass
-            if not result_text and hasattr(raw_result, "text"):
-                try:
-                    result_text = raw_result.text
-                except Exception:
-                    pass
-
-        if result_text is None:
-            result_text = str(raw_result)
+        full_prompt = f"{STORYBOARD_PROMPT}\n\nTranscript:\n{transcript}"
+        result_text = llm._call(full_prompt)
 
         # Try to parse JSON directly, then try extracting a JSON substring, else create a safe fallback
         storyboard = None
         try:
-            storyboard = json.loads(result_text)
+            storyboard = _loads_json(result_text)
         except json.JSONDecodeError:
             # Attempt to extract the first balanced JSON object from the text
             start = result_text.find("{")
             if start != -1:
                 count = 0
-                for i in range(start, len(result_text)):
-                    if result_text[i] == "{":
+                for match in _BRACE_RE.finditer(result_text, start):
+                    if match.group() == "{":
                         count += 1
-                    elif result_text[i] == "}":
+                    else:
                         count -= 1
                         if count == 0:
-                            candidate = result_text[start:i+1]
+                            candidate = result_text[start:match.end()]
                             try:
-                                storyboard = json.loads(candidate)
+                                storyboard = _loads_json(candidate)
                                 break
                             except json.JSONDecodeError:
                                 # continue searching
                                 continue
 
+        parsed = storyboard is not None
         if storyboard is None:
             # Build a schema-compliant fallback storyboard using the raw text as narration
             storyboard = {
@@ -210,63 +456,41 @@ class StoryboardAgent:
             }
 
         # Normalize and validate minimal schema expectations
-        def _normalize(sb: dict) -> dict:
-            if not isinstance(sb, dict):
-                return storyboard
-            if "title" not in sb:
-                sb["title"] = "Generated Storyboard"
-            if "scenes" not in sb or not isinstance(sb["scenes"], list):
-                sb["scenes"] = []
-
-            normalized = []
-            for idx, s in enumerate(sb["scenes"], start=1):
-                if not isinstance(s, dict):
-                    s = {"narration": str(s)}
-                scene_id = s.get("scene_id") or s.get("id") or idx
-                duration = s.get("duration", 5)
-                narration = s.get("narration") or s.get("description") or s.get("text") or ""
-                animation_type = s.get("animation_type") or s.get("type") or "text"
-
-                elements = s.get("elements") or s.get("actions") or []
-                normalized_elements = []
-                for e in elements:
-                    if isinstance(e, str):
-                        normalized_elements.append({
-                            "type": "text",
-                            "content": e,
-                            "position": [0, 0],
-                            "color": "WHITE",
-                            "animation": "FadeIn",
-                            "scale": 1.0
-                        })
-                        continue
-                    if not isinstance(e, dict):
-                        continue
-                    normalized_elements.append({
-                        "type": e.get("type", "text"),
-                        "content": e.get("content", ""),
-                        "position": e.get("position", [0, 0]),
-                        "color": e.get("color", "WHITE"),
-                        "animation": e.get("animation", "FadeIn"),
-                        "scale": e.get("scale", 1.0)
-                    })
-
-                normalized.append({
-                    "scene_id": int(scene_id),
-                    "duration": duration,
-                    "narration": narration,
-                    "animation_type": animation_type,
-                    "elements": normalized_elements
-                })
-
-            sb["scenes"] = normalized
-            return sb
+        storyboard = _normalize_storyboard(storyboard)
 
-        storyboard = _normalize(storyboard)
+        # Don't cache the plain-text fallback or non-object JSON, so a bad
+        # response can be retried instead of being replayed on every run
+        if use_cache and parsed and isinstance(storyboard, dict):
+            _write_cached_storyboard(cache_path, storyboard)
         return storyboard
 
 
+    def _generate_chunked(self, chunks: List[str], use_cache: bool) -> dict:
+        """Generate a storyboard per chunk concurrently and merge them in order.
+
+        Each chunk goes through generate_storyboard, so chunks are cached
+        individually and editing one section only regenerates that section.
+        """
+        workers = min(len(chunks), MAX_CONCURRENT_CHUNKS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(lambda c: self.generate_storyboard(c, use_cache), chunks))
+        return _merge_storyboards(parts)
+
     def save_storyboard(self, storyboard: dict, path: str):
         Path(path).parent.mkdir(parents=True, exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(storyboard, f, indent=2)
+        scenes = storyboard.get("scenes") if isinstance(storyboard, dict) else None
+        with open(path, "wb") as f:
+            if not isinstance(scenes, list):
+                f.write(_dumps_json(storyboard, indent=True))
+                return
+            # Write the scenes one at a time (one per line) so only a single
+            # serialized scene is held in memory, not the whole document.
+            f.write(b"{\n")
+            for key, value in storyboard.items():
+                if key != "scenes":
+                    f.write(b"  " + _dumps_json(key) + b": " + _dumps_json(value) + b",\n")
+            f.write(b'  "scenes": [')
+            for i, scene in enumerate(scenes):
+                f.write(b",\n    " if i else b"\n    ")
+                f.write(_dumps_json(scene))
+            f.write(b"\n  ]\n}\n")
@@ -1,3 +1,3 @@
-from .llm_config import LLMConfig
+from .llm_config import LLMConfig, get_config
 
-__all__ = ['LLMConfig']
\ No newline at end of file
+__all__ = ['LLMConfig', 'get_config']
\ No newline at end of file
@@ -1,7 +1,7 @@
 import os
+from functools import lru_cache
+from importlib import import_module
 from dotenv import load_dotenv
-from langchain_community.llms import Ollama
-from langchain_community.chat_models import ChatOpenAI, ChatAnthropic
 
 load_dotenv()
 
@@ -24,6 +24,9 @@ class LLMConfig:
         if not self.use_api:
             # Use Ollama (local)
             print(f"Using Ollama with model: {self.ollama_model}")
+            # langchain_community is imported lazily: it is slow to import and
+            # not needed at all when only rendering an existing storyboard.
+            Ollama = import_module("langchain_community.llms").Ollama
             return Ollama(
                 model=self.ollama_model,
                 base_url=self.ollama_base_url,
@@ -34,27 +37,10 @@ class LLMConfig:
             # Use API-based LLM
             print(f"Using API provider: {self.api_provider}")
             
-            if self.api_provider == "openai":
-                return ChatOpenAI(
-                    model="gpt-4",
-                    temperature=0.7,
-                    openai_api_key=self.api_key
-                )
-            elif self.api_provider == "anthropic":
-                return ChatAnthropic(
-                    model="claude-3-sonnet-20240229",
-                    temperature=0.7,
-                    anthropic_api_key=self.api_key
-                )
-            elif self.api_provider == "groq":
-                from langchain_community.chat_models import ChatGroq
-                return ChatGroq(
-                    model="mixtral-8x7b-32768",
-                    temperature=0.7,
-                    groq_api_key=self.api_key
-                )
-            else:
+            make_llm = _PROVIDERS.get(self.api_provider)
+            if make_llm is None:
                 raise ValueError(f"Unsupported API provider: {self.api_provider}")
+            return make_llm(self)
     
     def get_config_info(self):
         """Returns configuration information as a dictionary."""
@@ -67,4 +53,47 @@ class LLMConfig:
         if not self.use_api:
             info["timeout"] = self.ollama_timeout
             info["max_retries"] = self.ollama_max_retries
-        return info
\ No newline at end of file
+        return info
+
+
+@lru_cache(maxsize=None)
+def _chat_model_class(name: str):
+    """Import a langchain_community chat model class once, on first use."""
+    return getattr(import_module("langchain_community.chat_models"), name)
+
+
+def _make_openai(config: LLMConfig):
+    return _chat_model_class("ChatOpenAI")(
+        model="gpt-4",
+        temperature=0.7,
+        openai_api_key=config.api_key
+    )
+
+
+def _make_anthropic(config: LLMConfig):
+    return _chat_model_class("ChatAnthropic")(
+        model="claude-3-sonnet-20240229",
+        temperature=0.7,
+        anthropic_api_key=config.api_key
+    )
+
+
+def _make_groq(config: LLMConfig):
+    return _chat_model_class("ChatGroq")(
+        model="mixtral-8x7b-32768",
+        temperature=0.7,
+        groq_api_key=config.api_key
+    )
+
+
+_PROVIDERS = {
+    "openai": _make_openai,
+    "anthropic": _make_anthropic,
+    "groq": _make_groq,
+}
+
+
+@lru_cache(maxsize=1)
+def get_config() -> LLMConfig:
+    """Returns the process-wide LLMConfig, built once from the environment."""
+    return LLMConfig()
\ No newline at end of file
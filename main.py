@@ -6,7 +6,7 @@ Converts transcript to animated educational videos using Manim
 
 import argparse
 import sys
-from agents import StoryboardAgent
+from pathlib import Path
 from renderer import ManimRenderer
 
 def main():
@@ -61,14 +61,25 @@ def main():
         help="Only generate storyboard, don't render video"
     )
     
+    parser.add_argument(
+        "--subprocess-render",
+        action="store_true",
+        help="Render with the manim CLI in a separate process instead of in-process"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always call the LLM, ignoring any cached storyboard for this transcript"
+    )
+    
     args = parser.parse_args()
     
     # Get transcript
     transcript = None
     if args.transcript_file:
         try:
-            with open(args.transcript_file, "r", encoding="utf-8") as f:
-                transcript = f.read()
+            transcript = Path(args.transcript_file).read_text(encoding="utf-8")
         except FileNotFoundError:
             print(f"Error: Transcript file not found: {args.transcript_file}")
             sys.exit(1)
@@ -85,9 +96,12 @@ def main():
         print("STEP 1: Generating Storyboard")
         print("="*60)
         
+        # Imported here so --skip-generation doesn't pay for loading the LLM stack
+        from agents import StoryboardAgent
+
         agent = StoryboardAgent()
         try:
-            storyboard = agent.generate_storyboard(transcript)
+            storyboard = agent.generate_storyboard(transcript, use_cache=not args.no_cache)
             agent.save_storyboard(storyboard, args.storyboard)
             
             print(f"\nStoryboard Summary:")
@@ -126,7 +140,11 @@ def main():
         
         # Render
         print("\nStarting render...")
-        success = renderer.render_video(quality=args.quality, output_dir=args.output)
+        success = renderer.render_video(
+            quality=args.quality,
+            output_dir=args.output,
+            in_process=not args.subprocess_render
+        )
         
         if success:
             print("\n" + "="*60)
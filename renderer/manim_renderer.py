@@ -1,19 +1,188 @@
 import os
+import asyncio
+import codecs
+import re
 import json
-import subprocess
-from typing import Dict, List
+import glob
+import hashlib
+import importlib.util
+import itertools
+import traceback
+from functools import cached_property, lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Sequence
+
+from jinja2 import Environment, FileSystemLoader
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
+
+ElementType = Literal["text", "equation", "circle", "square", "arrow", "line", "axes", "graph"]
+
+# Manim constructor expression per storyboard element type; {content} is
+# replaced with the element's content as a Python string literal.
+_ELEMENT_TEMPLATES: Dict[ElementType, str] = {
+    "text": "Text({content})",
+    "equation": "MathTex({content})",
+    "circle": "Circle()",
+    "square": "Square()",
+    "arrow": "Arrow(start=LEFT, end=RIGHT)",
+    "line": "Line(start=LEFT, end=RIGHT)",
+    "axes": "Axes()",
+    "graph": "Axes()",
+}
+# One shared encoder for element literals; JSON string output is also a valid
+# Python string literal. Calling encode directly skips json.dumps' per-call
+# keyword handling on this per-element path.
+_encode_literal = json.JSONEncoder().encode
+# Printable ASCII other than '"' and '\\' needs no escaping, so such strings
+# can be quoted directly without going through the encoder
+_is_plain_ascii = re.compile(r'[\x20\x21\x23-\x5B\x5D-\x7E]*').fullmatch
+_UNKNOWN_ELEMENT = "Text(" + _encode_literal("Unknown element") + ")"
+
+# Color constants exported by `from manim import *`; these are emitted as bare
+# identifiers, anything else (hex codes, CSS names) as a quoted string
+_MANIM_COLORS = frozenset(
+    [
+        f"{base}{shade}"
+        for base in ("BLUE", "TEAL", "GREEN", "YELLOW", "GOLD", "RED", "MAROON", "PURPLE", "GRAY", "GREY")
+        for shade in ("", "_A", "_B", "_C", "_D", "_E")
+    ]
+    + [
+        "WHITE", "BLACK", "ORANGE", "PINK", "LIGHT_PINK",
+        "LIGHT_GRAY", "LIGHT_GREY", "LIGHTER_GRAY", "LIGHTER_GREY",
+        "DARK_GRAY", "DARK_GREY", "DARKER_GRAY", "DARKER_GREY",
+        "DARK_BLUE", "DARK_BROWN", "LIGHT_BROWN", "GRAY_BROWN", "GREY_BROWN",
+        "PURE_RED", "PURE_GREEN", "PURE_BLUE",
+    ]
+)
+
+
+def _python_literal(value) -> str:
+    """Python source literal for a storyboard value, as JSON encoding would give."""
+    if isinstance(value, str) and _is_plain_ascii(value):
+        return '"' + value + '"'
+    return _encode_literal(value)
+
+ElementHandler = Callable[[str, Any, str, Any, Sequence], str]
+
+
+def _make_element_handler(constructor: str) -> ElementHandler:
+    """Specialize one element type's code line, splitting the template once up front."""
+    head, placeholder, tail = constructor.partition("{content}")
+    if placeholder:
+        def handler(var_name, content, color_literal, scale, position):
+            return (
+                f"        {var_name} = {head}{_python_literal(content)}{tail}.set_color({color_literal})"
+                f".scale({scale}).move_to([{position[0]}, {position[1]}, {position[2]}])\n"
+            )
+    else:
+        # Shapes ignore content, so it is never encoded for them
+        def handler(var_name, content, color_literal, scale, position):
+            return (
+                f"        {var_name} = {constructor}.set_color({color_literal})"
+                f".scale({scale}).move_to([{position[0]}, {position[1]}, {position[2]}])\n"
+            )
+    return handler
+
+
+_HANDLERS: Dict[str, ElementHandler] = {
+    elem_type: _make_element_handler(constructor)
+    for elem_type, constructor in _ELEMENT_TEMPLATES.items()
+}
+_UNKNOWN_HANDLER = _make_element_handler(_UNKNOWN_ELEMENT)
+
+# manim CLI -q flags mapped to the equivalent config "quality" values
+_QUALITY_NAMES = {
+    "l": "low_quality",
+    "m": "medium_quality",
+    "h": "high_quality",
+    "k": "fourk_quality",
+}
+# Resolution subdirectory Manim renders each quality into
+_QUALITY_DIRS = {
+    "l": "480p15",
+    "m": "720p30",
+    "h": "1080p60",
+    "k": "2160p60",
+}
+
+
+@lru_cache(maxsize=1)
+def _generator_fingerprint() -> bytes:
+    """Bytes identifying the code generator, so generator changes invalidate scene files.
+
+    Computed on first use, so runs that never hash a storyboard skip the reads.
+    """
+    parts = []
+    templates = sorted(glob.glob(os.path.join(TEMPLATE_DIR, "*.j2")))
+    for path in [__file__] + templates:
+        with open(path, "rb") as f:
+            parts.append(f.read())
+    return hashlib.blake2b(b"\0".join(parts), digest_size=16).digest()
+
+
+@lru_cache(maxsize=8)
+def _load_storyboard_cached(path: str, mtime_ns: int, size: int) -> dict:
+    """Parse a storyboard file; mtime and size in the key invalidate stale entries.
+
+    The returned dict is shared between renderers and must not be mutated.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
 
 class ManimRenderer:
     def __init__(self, storyboard_path: str = "data/storyboard.json"):
         self.storyboard_path = storyboard_path
-        loaded = self._load_storyboard()
-        self.storyboard = self._normalize_storyboard(loaded)
+        self.normalized_cache_path = storyboard_path + ".norm.json"
+        # Stat the source once so the parse cache and the normalized cache
+        # are both keyed on the same version of the file
+        self._source_stat = os.stat(storyboard_path)
+        cached = self._load_normalized_cache()
+        if cached is not None:
+            self.storyboard = cached
+        else:
+            loaded = self._load_storyboard()
+            self.storyboard = self._normalize_storyboard(loaded)
         self.scene_file_path = "scenes/generated_scene.py"
     
     def _load_storyboard(self) -> dict:
-        """Load the storyboard JSON."""
-        with open(self.storyboard_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        """Load the storyboard JSON, reusing the parse while the file is unchanged."""
+        stat = self._source_stat
+        return _load_storyboard_cached(self.storyboard_path, stat.st_mtime_ns, stat.st_size)
+
+    def _load_normalized_cache(self) -> Optional[dict]:
+        """Return the normalized storyboard saved next to the source, if still fresh.
+
+        The cache records the source's mtime and size when it was written; any
+        mismatch (or a malformed cache file) counts as a miss.
+        """
+        try:
+            with open(self.normalized_cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        stat = self._source_stat
+        if (not isinstance(cached, dict)
+                or cached.get("source_mtime_ns") != stat.st_mtime_ns
+                or cached.get("source_size") != stat.st_size
+                or not isinstance(cached.get("storyboard"), dict)):
+            return None
+        return cached["storyboard"]
+
+    def _save_normalized_cache(self, storyboard: dict):
+        """Atomically write the normalized storyboard so warm runs skip both parses."""
+        tmp_path = self.normalized_cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "source_mtime_ns": self._source_stat.st_mtime_ns,
+                    "source_size": self._source_stat.st_size,
+                    "storyboard": storyboard
+                }, f)
+            os.replace(tmp_path, self.normalized_cache_path)
+        except OSError:
+            # The cache is an optimization only; never fail a render over it
+            pass
 
     def _normalize_storyboard(self, storyboard: dict) -> dict:
         """Normalize different storyboard formats into a standard dict with a 'scenes' list.
@@ -37,123 +206,184 @@ class ManimRenderer:
                             merged["title"] = storyboard.get("title")
                         if "description" not in merged and "description" in storyboard:
                             merged["description"] = storyboard.get("description")
+                        # Only the embedded-JSON format is worth caching; plain
+                        # storyboards need no re-parse to normalize
+                        self._save_normalized_cache(merged)
                         return merged
                 except json.JSONDecodeError:
                     # Not parseable JSON; fall back to original
                     pass
         return storyboard
 
-    def _generate_scene_code(self) -> str:
-        """Generate Python code for the Manim scene based on storyboard."""
-        code = """from manim import *
+    def _scene_stream(self, scenes: Optional[Iterable[dict]] = None):
+        """Return a TemplateStream yielding the scene code piece by piece.
 
-class GeneratedScene(Scene):
-    def construct(self):
-"""
+        `scenes` may be any iterable (including a generator); it defaults to
+        the storyboard's scenes, which are rendered lazily as the stream is
+        consumed.
+        """
+        if scenes is None:
+            scenes = self.storyboard.get("scenes", [])
+        bodies = map(_render_one_scene, itertools.count(1), scenes)
+        return self._get_template().stream(scene_bodies=bodies)
 
-        scenes = self.storyboard.get("scenes", [])
-        for i, scene in enumerate(scenes, start=1):
-            scene_id = scene.get("scene_id", scene.get("id", i))
-            narration = scene.get("narration", scene.get("description", ""))
-            # Sanitize narration so multi-line or large content doesn't inject raw text into the generated Python
-            safe_narration = (narration or "").replace("\n", " ").replace("\r", " ")
-            code += f"\n        # Scene {scene_id}: {safe_narration[:70]}...\n"
-
-            # Generate code for each element
-            element_vars = []
-            elements = scene.get("elements", [])
-            for idx, element in enumerate(elements):
-                var_name = f"elem_{scene_id}_{idx}"
-                element_vars.append(var_name)
-
-                # Create the element
-                code += self._create_element_code(var_name, element)
-
-            # Animate the elements
-            if element_vars:
-                animations = []
-                for j, element in enumerate(elements):
-                    var_name = element_vars[j]
-                    anim = element.get("animation", "FadeIn")
-                    animations.append(f"{anim}({var_name})")
-
-                code += f"        self.play({', '.join(animations)})\n"
-
-                # Wait for scene duration
-                duration = scene.get("duration", 3)
-                wait_time = max(0, duration - 1)
-                code += f"        self.wait({wait_time})\n"
-
-                # Fade out at the end of the scene
-                code += f"        self.play({', '.join([f'FadeOut({v})' for v in element_vars])})\n"
-
-        code += "        self.wait(1)\n"
-        return code
+    def _generate_scene_code(self, scenes: Optional[Iterable[dict]] = None) -> str:
+        """Generate Python code for the Manim scene based on storyboard."""
+        return "".join(self._scene_stream(scenes))
+
+    @classmethod
+    def _get_template(cls):
+        """Compile the scene template once per class and reuse it for every renderer."""
+        template = getattr(cls, "_scene_template", None)
+        if template is None:
+            env = Environment(
+                loader=FileSystemLoader(TEMPLATE_DIR),
+                trim_blocks=True,
+                lstrip_blocks=True,
+                keep_trailing_newline=True
+            )
+            template = env.get_template("scene.py.j2")
+            cls._scene_template = template
+        return template
     
-    def _create_element_code(self, var_name: str, element: dict) -> str:
+    @staticmethod
+    def _create_element_code(var_name: str, element: dict) -> str:
         """Generate code to create a single element."""
-        code = ""
         elem_type = element.get("type", "text")
         content = element.get("content", "")
-        position = list(element.get("position", [0, 0, 0]))
+        # Pad [x, y] (or a shorter list) to three coordinates without copying into a list
+        position = (*element.get("position", ()), 0, 0, 0)[:3]
         color = element.get("color", "WHITE")
         scale = element.get("scale", 1.0)
         
-        # Ensure position has 3 elements
-        if len(position) == 2:
-            position.append(0)
+        # Determine color literal: use the bare identifier for Manim color constants, else quote it
+        color_literal = color if isinstance(color, str) and color in _MANIM_COLORS else _python_literal(color)
         
-        # Prepare content literal safely (JSON encoding produces a valid Python string literal)
-        content_literal = json.dumps(content)
-        # Determine color literal: use unquoted identifier if it looks like a Manim color constant (UPPERCASE), else quote it
-        color_literal = color if isinstance(color, str) and color.isupper() else json.dumps(color)
-        
-        # Create the element based on type
-        if elem_type == "text":
-            code += f"        {var_name} = Text({content_literal})\n"
-        elif elem_type == "equation":
-            code += f"        {var_name} = MathTex({content_literal})\n"
-        elif elem_type == "circle":
-            code += f"        {var_name} = Circle()\n"
-        elif elem_type == "square":
-            code += f"        {var_name} = Square()\n"
-        elif elem_type == "arrow":
-            code += f"        {var_name} = Arrow(start=LEFT, end=RIGHT)\n"
-        elif elem_type == "line":
-            code += f"        {var_name} = Line(start=LEFT, end=RIGHT)\n"
-        elif elem_type == "axes":
-            code += f"        {var_name} = Axes()\n"
-        elif elem_type == "graph":
-            code += f"        {var_name} = Axes()\n"
-        else:
-            # Use a safe string literal for unknown element text
-            unknown_literal = json.dumps("Unknown element")
-            code += f"        {var_name} = Text({unknown_literal})\n"
-        
-        # Apply properties
-        code += f"        {var_name}.set_color({color_literal})\n"
-        code += f"        {var_name}.scale({scale})\n"
-        code += f"        {var_name}.move_to([{position[0]}, {position[1]}, {position[2]}])\n"
-        
-        return code
+        # Unknown types render a placeholder; the handler encodes content itself
+        # (JSON encoding produces a valid Python string literal)
+        handler = _HANDLERS.get(elem_type, _UNKNOWN_HANDLER)
+        return handler(var_name, content, color_literal, scale, position)
     
+    def _storyboard_hash(self) -> str:
+        """Hash the storyboard together with the code generator that renders it."""
+        digest = hashlib.blake2b(_generator_fingerprint(), digest_size=16)
+        digest.update(json.dumps(self.storyboard, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
     def generate_scene_file(self):
-        """Generate the scene Python file."""
-        code = self._generate_scene_code()
-        with open(self.scene_file_path, "w", encoding="utf-8") as f:
-            f.write(code)
+        """Generate the scene Python file, unless it is already up to date."""
+        hash_path = self.scene_file_path + ".hash"
+        storyboard_hash = self._storyboard_hash()
+        if os.path.exists(self.scene_file_path):
+            try:
+                with open(hash_path, "r", encoding="utf-8") as f:
+                    if f.read().strip() == storyboard_hash:
+                        print(f"Scene file up to date: {self.scene_file_path}")
+                        return
+            except OSError:
+                pass
+
+        # Render into a temp file and swap it in, so a failed or interrupted
+        # generation never leaves a truncated scene file behind
+        tmp_path = self.scene_file_path + ".tmp"
+        try:
+            self._scene_stream().dump(tmp_path, encoding="utf-8")
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        os.replace(tmp_path, self.scene_file_path)
+        with open(hash_path, "w", encoding="utf-8") as f:
+            f.write(storyboard_hash)
         print(f"Scene file generated: {self.scene_file_path}")
+
+    def _expected_video_path(self, quality: str, output_dir: str) -> str:
+        """Where Manim writes the rendered video for these settings."""
+        module_name = os.path.splitext(os.path.basename(self.scene_file_path))[0]
+        file_name = (output_dir or "GeneratedScene") + ".mp4"
+        return os.path.join("media", "videos", module_name, _QUALITY_DIRS[quality], file_name)
     
-    def render_video(self, quality: str = "l", output_dir: str = "media"):
+    def render_video(self, quality: str = "l", output_dir: str = "media", in_process: bool = True):
         """
         Render the video using Manim.
         
         Args:
             quality: Quality setting (l=low, m=medium, h=high, k=4k)
             output_dir: Output directory for the video
+            in_process: Render through Manim's Python API in this process; set
+                to False to run the `manim` CLI in an isolated subprocess
+        """
+        if self._prepare_render(quality, output_dir):
+            return True
+        
+        if in_process:
+            return self._render_in_process(quality, output_dir)
+        return self._render_subprocess(quality, output_dir)
+    
+    async def render_video_async(self, quality: str = "l", output_dir: str = "media") -> bool:
         """
+        Render the video with the manim CLI without blocking the event loop.
+        
+        Lets a caller render several storyboards concurrently from one loop;
+        give each renderer its own scene_file_path so they don't overwrite
+        each other's generated scene.
+        
+        Args:
+            quality: Quality setting (l=low, m=medium, h=high, k=4k)
+            output_dir: Output directory for the video
+        """
+        if self._prepare_render(quality, output_dir):
+            return True
+        return await self._render_subprocess_async(quality, output_dir)
+    
+    def _prepare_render(self, quality: str, output_dir: str) -> bool:
+        """Write the scene file; return True if the rendered video is already current."""
         self.generate_scene_file()
         
+        # A video newer than the scene file was rendered from this exact code
+        video_path = self._expected_video_path(quality, output_dir)
+        if os.path.exists(video_path) and os.path.getmtime(video_path) >= os.path.getmtime(self.scene_file_path):
+            print(f"Video already up to date: {video_path}")
+            return True
+        return False
+    
+    def _render_in_process(self, quality: str, output_dir: str) -> bool:
+        """Import the generated scene and render it without spawning the manim CLI."""
+        # Manim is heavy to import; only load it when actually rendering
+        from manim import tempconfig
+        
+        render_config = {
+            "quality": _QUALITY_NAMES[quality],
+            "input_file": self.scene_file_path
+        }
+        if output_dir:
+            render_config["output_file"] = output_dir
+        
+        print(f"Rendering video in-process with config: {render_config}")
+        
+        try:
+            # Load from the file every time: it was just regenerated
+            spec = importlib.util.spec_from_file_location("generated_scene", self.scene_file_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            with tempconfig(render_config):
+                module.GeneratedScene().render()
+        except Exception as e:
+            print(f"Error rendering video: {e}")
+            # Unlike the CLI there is no manim error report here; show the full traceback
+            traceback.print_exc()
+            return False
+        print("Video rendered successfully!")
+        return True
+    
+    def _render_subprocess(self, quality: str, output_dir: str) -> bool:
+        """Render by running the manim CLI in a separate process."""
+        return asyncio.run(self._render_subprocess_async(quality, output_dir))
+    
+    async def _render_subprocess_async(self, quality: str, output_dir: str) -> bool:
+        """Run the manim CLI as an asyncio subprocess, streaming its output."""
         # Construct manim command
         cmd = [
             "manim",
@@ -167,19 +397,39 @@ class GeneratedScene(Scene):
         
         print(f"Rendering video with command: {' '.join(cmd)}")
         
+        # Stream Manim's combined output as it arrives instead of buffering
+        # the whole log, so long renders show progress and memory stays flat
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
         try:
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            print("Video rendered successfully!")
-            print(result.stdout)
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"Error rendering video: {e}")
-            print(f"stdout: {e.stdout}")
-            print(f"stderr: {e.stderr}")
+            # Copy in fixed-size chunks rather than lines: progress bars redraw
+            # with \r only, so a single "line" can grow without bound
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            while True:
+                chunk = await proc.stdout.read(65536)
+                if not chunk:
+                    break
+                print(decoder.decode(chunk), end="", flush=True)
+            print(decoder.decode(b"", final=True), end="")
+            returncode = await proc.wait()
+        finally:
+            # Never leave the child running or unreaped, e.g. on cancellation
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+        
+        if returncode != 0:
+            print(f"Error rendering video: manim exited with status {returncode}")
             return False
+        print("Video rendered successfully!")
+        return True
     
-    def get_video_info(self) -> dict:
-        """Get information about the video that will be generated."""
+    @cached_property
+    def _video_info(self) -> dict:
+        """Summary of the video, computed on first access."""
         scenes = self.storyboard.get("scenes", [])
         total_duration = sum(scene.get("duration", 3) for scene in scenes)
         return {
@@ -187,4 +437,42 @@ class GeneratedScene(Scene):
             "description": self.storyboard.get("description", ""),
             "num_scenes": len(scenes),
             "total_duration": total_duration
-        }
\ No newline at end of file
+        }
+    
+    def get_video_info(self) -> dict:
+        """Get information about the video that will be generated."""
+        # A copy, so callers can modify it without touching the cached summary
+        return dict(self._video_info)
+
+
+def _render_one_scene(scene_index: int, scene: dict) -> str:
+    """Generate the code for one scene of the storyboard.
+
+    Built with plain string joins rather than a template: this runs once per
+    scene and Jinja rendering here was several times slower.
+    """
+    scene_id = scene.get("scene_id", scene.get("id", scene_index))
+    narration = scene.get("narration", scene.get("description", ""))
+    # Sanitize narration so multi-line or large content doesn't inject raw text into the generated Python
+    safe_narration = (narration or "").replace("\n", " ").replace("\r", " ")
+    header = f"\n        # Scene {scene_id}: {safe_narration[:70]}...\n"
+
+    elements = scene.get("elements", [])
+    if not elements:
+        return header
+
+    var_names = [f"elem_{scene_id}_{idx}" for idx in range(len(elements))]
+    parts = [header]
+    parts.extend(map(ManimRenderer._create_element_code, var_names, elements))
+    animations = ", ".join(
+        f"{element.get('animation', 'FadeIn')}({var_name})"
+        for var_name, element in zip(var_names, elements)
+    )
+    fade_outs = ", ".join(f"FadeOut({var_name})" for var_name in var_names)
+    wait_time = max(0, scene.get("duration", 3) - 1)
+    parts.append(
+        f"        self.play({animations})\n"
+        f"        self.wait({wait_time})\n"
+        f"        self.play({fade_outs})\n"
+    )
+    return "".join(parts)